@@ -0,0 +1,311 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+import numpy as np
+from scipy import stats
+from sklearn.base import clone
+from sklearn.metrics import adjusted_rand_score
+from threadpoolctl import threadpool_limits
+
+
+## Silhouette
+# Function to compute the exact silhouette of a subset of points against the whole dataset
+def chunked_silhouette_samples(X, labels, indices, working_memory=256):
+    """
+    Computes the silhouette of the points in indices, processing them in chunks so that
+    the distance matrix kept in memory does not exceed the working memory.
+
+    Parameters:
+        X (array-like): Data used for clustering.
+        labels (array-like): Cluster labels for data points.
+        indices (array-like): Positions of the points to evaluate.
+        working_memory (int): Memory budget in MB for the distances of each chunk.
+
+    Returns:
+        np.ndarray: Silhouette value of each evaluated point.
+    """
+    X = np.asarray(X, dtype=float)
+    clusters, labels = np.unique(labels, return_inverse=True)
+    n, n_clusters = len(labels), len(clusters)
+    counts = np.bincount(labels, minlength=n_clusters)
+    sq_norms = (X ** 2).sum(axis=1)
+    one_hot = np.zeros((n, n_clusters))
+    one_hot[np.arange(n), labels] = 1
+
+    # Each chunk holds a single (chunk_size x n) matrix of float64 distances
+    chunk_size = max(1, int(working_memory * 2 ** 20) // (8 * n))
+
+    values = []
+    for start in range(0, len(indices), chunk_size):
+        idx = np.asarray(indices[start:start + chunk_size])
+        rows = np.arange(len(idx))
+
+        # Euclidean distances from the chunk to every point, computed in place
+        dist = X[idx] @ X.T
+        dist *= -2
+        dist += sq_norms[idx][:, None]
+        dist += sq_norms[None, :]
+        np.maximum(dist, 0, out=dist)
+        np.sqrt(dist, out=dist)
+        dist[rows, idx] = 0
+
+        # Sum of distances to each cluster
+        sums = dist @ one_hot
+        del dist
+
+        own = labels[idx]
+        own_size = counts[own] - 1
+        a = sums[rows, own] / np.maximum(own_size, 1)
+        means = sums / counts
+        means[rows, own] = np.inf
+        b = means.min(axis=1)
+
+        s = (b - a) / np.maximum(a, b)
+        # Points in singleton clusters have a silhouette of 0
+        s[own_size == 0] = 0
+        values.append(np.nan_to_num(s))
+
+    return np.concatenate(values) if values else np.array([])
+
+def sampled_silhouette(X, labels, sample_size=10000, working_memory=256, confidence=0.95, random_state=None):
+    """
+    Estimates the silhouette score from a random sample of points, each compared against
+    the full dataset. The cost is O(sample_size * n) instead of O(n^2).
+
+    Parameters:
+        X (array-like): Data used for clustering.
+        labels (array-like): Cluster labels for data points.
+        sample_size (int): Number of points to evaluate. If None or larger than the data, all points are used.
+        working_memory (int): Memory budget in MB for the distances of each chunk.
+        confidence (float): Confidence level of the interval.
+        random_state (int, optional): Seed for the sample.
+
+    Returns:
+        dict: Estimated silhouette with the lower and upper bounds of the confidence interval.
+    """
+    n = len(labels)
+    if sample_size is None or sample_size >= n:
+        indices = np.arange(n)
+    else:
+        rng = np.random.default_rng(random_state)
+        indices = np.sort(rng.choice(n, size=sample_size, replace=False))
+
+    values = chunked_silhouette_samples(X, labels, indices, working_memory)
+    mean = values.mean()
+
+    # No sampling error when every point is evaluated
+    if len(values) == n or len(values) < 2:
+        margin = 0.0
+    else:
+        # Normal interval with finite population correction
+        fpc = np.sqrt((n - len(values)) / (n - 1))
+        margin = stats.norm.ppf(0.5 + confidence / 2) * values.std(ddof=1) / np.sqrt(len(values)) * fpc
+
+    return {'Silhouette': mean,
+            'Silhouette Lower': mean - margin,
+            'Silhouette Upper': mean + margin}
+
+
+## Centroid-based metrics
+# Function to iterate over a dataset in chunks of rows
+def iter_chunks(X, labels, chunk_size=10000):
+    for start in range(0, len(labels), chunk_size):
+        yield (np.asarray(X[start:start + chunk_size], dtype=float),
+               labels[start:start + chunk_size])
+
+def streaming_cluster_scores(X, labels, chunk_size=10000):
+    """
+    Computes the Calinski-Harabasz and Davies-Bouldin scores in two passes over the data,
+    keeping only per-cluster statistics in memory.
+
+    Parameters:
+        X (array-like): Data used for clustering.
+        labels (array-like): Cluster labels for data points.
+        chunk_size (int): Number of rows processed per chunk.
+
+    Returns:
+        dict: Calinski-Harabasz and Davies-Bouldin scores.
+    """
+    # Chunks are converted to float while iterating, so memory-mapped arrays are not loaded at once
+    X = X.to_numpy() if isinstance(X, pd.DataFrame) else np.asarray(X)
+    clusters, labels = np.unique(labels, return_inverse=True)
+    n_clusters, n = len(clusters), len(labels)
+    if not 1 < n_clusters < n:
+        raise ValueError(f'Number of labels is {n_clusters}. Valid values are 2 to n_samples - 1 (inclusive).')
+
+    # First pass: cluster sizes and centroids
+    counts = np.zeros(n_clusters)
+    sums = np.zeros((n_clusters, X.shape[1]))
+    for chunk, chunk_labels in iter_chunks(X, labels, chunk_size):
+        counts += np.bincount(chunk_labels, minlength=n_clusters)
+        np.add.at(sums, chunk_labels, chunk)
+    centroids = sums / counts[:, None]
+    mean = sums.sum(axis=0) / n
+
+    # Second pass: dispersion around the centroids
+    within_ss = 0.0
+    dist_sums = np.zeros(n_clusters)
+    for chunk, chunk_labels in iter_chunks(X, labels, chunk_size):
+        sq_dist = ((chunk - centroids[chunk_labels]) ** 2).sum(axis=1)
+        within_ss += sq_dist.sum()
+        dist_sums += np.bincount(chunk_labels, weights=np.sqrt(sq_dist), minlength=n_clusters)
+
+    between_ss = (counts * ((centroids - mean) ** 2).sum(axis=1)).sum()
+    calinski_harabasz = 1.0 if within_ss == 0 else between_ss * (n - n_clusters) / (within_ss * (n_clusters - 1))
+
+    intra_dists = dist_sums / counts
+    centroid_dists = np.sqrt(((centroids[:, None, :] - centroids[None, :, :]) ** 2).sum(axis=2))
+    if np.allclose(intra_dists, 0) or np.allclose(centroid_dists, 0):
+        davies_bouldin = 0.0
+    else:
+        centroid_dists[centroid_dists == 0] = np.inf
+        ratios = (intra_dists[:, None] + intra_dists[None, :]) / centroid_dists
+        davies_bouldin = ratios.max(axis=1).mean()
+
+    return {'Calinski-Harabasz': calinski_harabasz,
+            'Davies-Bouldin': davies_bouldin}
+
+
+## Stability
+def bootstrap_stability(estimator, X, labels=None, n_bootstraps=10, sample_fraction=1.0, random_state=None):
+    """
+    Measures how stable a segmentation is by refitting the estimator on bootstrap samples
+    and comparing the new labels with the reference ones using the Adjusted Rand Index.
+
+    Parameters:
+        estimator: Unfitted scikit-learn clustering estimator.
+        X (array-like): Data used for clustering.
+        labels (array-like, optional): Reference labels. If None, the estimator is fitted on X.
+        n_bootstraps (int): Number of bootstrap refits.
+        sample_fraction (float): Size of each bootstrap sample as a fraction of the data.
+        random_state (int, optional): Seed for the bootstrap samples.
+
+    Returns:
+        dict: Mean and standard deviation of the Adjusted Rand Index across refits.
+    """
+    X = np.asarray(X, dtype=float)
+    if labels is None:
+        labels = clone(estimator).fit_predict(X)
+    labels = np.asarray(labels)
+
+    rng = np.random.default_rng(random_state)
+    n = len(labels)
+    scores = []
+    for _ in range(n_bootstraps):
+        indices = rng.choice(n, size=int(n * sample_fraction), replace=True)
+        model = clone(estimator).fit(X[indices])
+
+        # Compare on the full data if the model can label new points, otherwise on the sampled ones
+        if hasattr(model, 'predict'):
+            scores.append(adjusted_rand_score(labels, model.predict(X)))
+        else:
+            unique, first = np.unique(indices, return_index=True)
+            scores.append(adjusted_rand_score(labels[unique], model.labels_[first]))
+
+    return {'Stability': np.mean(scores),
+            'Stability Std': np.std(scores)}
+
+
+## Comparison of candidates
+# Metrics reported for each candidate, left as NaN when its evaluation fails
+metric_columns = ['Silhouette', 'Silhouette Lower', 'Silhouette Upper',
+                  'Calinski-Harabasz', 'Davies-Bouldin', 'Stability', 'Stability Std']
+
+# Function to check that a candidate can be evaluated on a dataset with n_rows rows
+def check_candidate(name, candidate, n_rows):
+    labels = candidate.get('labels')
+    if candidate.get('estimator') is None and labels is None:
+        raise ValueError(f"Candidate '{name}' needs an 'estimator' or precomputed 'labels'.")
+    if labels is not None and len(labels) != n_rows:
+        raise ValueError(f"Candidate '{name}' has {len(labels)} labels but the data has {n_rows} rows.")
+
+# Function to evaluate a single candidate segmentation
+# Errors are recorded in the row instead of raised, so one degenerate candidate
+# (e.g. a single cluster) does not abort the whole comparison
+def evaluate_candidate(name, candidate, X, sample_size=10000, n_bootstraps=10, random_state=None):
+    check_candidate(name, candidate, len(X))
+    features = candidate.get('features')
+    result = {'Candidate': name, 'Features': np.nan, 'Clusters': np.nan}
+    result.update({metric: np.nan for metric in metric_columns})
+    result['Error'] = None
+    try:
+        if isinstance(X, pd.DataFrame):
+            data = (X[features] if features is not None else X).to_numpy(dtype=float)
+        else:
+            # Features are column positions when X is an array
+            data = np.asarray(X, dtype=float)
+            data = data[:, features] if features is not None else data
+        result['Features'] = data.shape[1]
+
+        estimator = candidate.get('estimator')
+        labels = candidate.get('labels')
+        if labels is None:
+            labels = clone(estimator).fit_predict(data)
+        labels = np.asarray(labels)
+        result['Clusters'] = len(np.unique(labels))
+
+        # The centroid-based scores come first since they reject degenerate labels
+        metrics = streaming_cluster_scores(data, labels)
+        metrics.update(sampled_silhouette(data, labels, sample_size=sample_size, random_state=random_state))
+        if estimator is not None and n_bootstraps:
+            metrics.update(bootstrap_stability(estimator, data, labels, n_bootstraps=n_bootstraps,
+                                               random_state=random_state))
+        result.update(metrics)
+    except Exception as error:
+        result['Error'] = f'{type(error).__name__}: {error}'
+    return result
+
+# Data and thread limits of each worker process, set once by init_worker
+worker_X = None
+worker_limits = None
+
+# Function to prepare a worker: receive the data once and use a single BLAS/OpenMP thread,
+# since the parallelism already comes from the processes
+def init_worker(X):
+    global worker_X, worker_limits
+    worker_X = X
+    worker_limits = threadpool_limits(limits=1)
+
+def evaluate_in_worker(name, candidate, sample_size, n_bootstraps, random_state):
+    return evaluate_candidate(name, candidate, worker_X, sample_size, n_bootstraps, random_state)
+
+def compare_segmentations(X, candidates, sample_size=10000, n_bootstraps=10, n_jobs=None, random_state=42):
+    """
+    Evaluates candidate segmentations in parallel and summarizes them in a comparison table.
+
+    Parameters:
+        X (pd.DataFrame or array-like): Data used for clustering.
+        candidates (dict): Candidates keyed by name. Each one has an unfitted 'estimator' and/or
+            precomputed 'labels', and optionally the 'features' to use (column names of a
+            DataFrame or column positions of an array).
+        sample_size (int): Number of points used to estimate the silhouette.
+        n_bootstraps (int): Number of bootstrap refits for the stability. Set to 0 to skip it.
+        n_jobs (int, optional): Number of processes. Defaults to the number of CPUs.
+        random_state (int, optional): Seed for the sampling and the bootstrap.
+
+    Returns:
+        pd.DataFrame: One row per candidate, sorted by silhouette. Candidates whose evaluation
+            failed have NaN metrics and the reason in the 'Error' column.
+    """
+    if not candidates:
+        raise ValueError('At least one candidate segmentation is required.')
+    for name, candidate in candidates.items():
+        check_candidate(name, candidate, len(X))
+
+    n_jobs = min(n_jobs or os.cpu_count() or 1, len(candidates))
+    names = list(candidates)
+
+    if n_jobs <= 1:
+        results = [evaluate_candidate(name, candidates[name], X, sample_size, n_bootstraps, random_state)
+                   for name in names]
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=init_worker, initargs=(X,)) as executor:
+            futures = [executor.submit(evaluate_in_worker, name, candidates[name],
+                                       sample_size, n_bootstraps, random_state)
+                       for name in names]
+            results = [future.result() for future in futures]
+
+    return (pd.DataFrame(results)
+            .set_index('Candidate')
+            .sort_values('Silhouette', ascending=False))
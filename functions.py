@@ -408,36 +408,37 @@ def mode(value):
         # if no frequent value is found, return the first value
         return value.iloc[0] 
 
-# Function to aggregate data based on 'DocIDHash','NameHash' and 'DistributionChannel'
-def aggregation(dataframe):
-    aggregation_rules = {
-        'Age': 'median',
-        'DaysSinceCreation': 'max',
-        'AverageLeadTime': 'mean',
-        'LodgingRevenue': 'sum',
-        'OtherRevenue': 'sum',
-        'BookingsCanceled': 'sum',
-        'BookingsNoShowed': 'sum',
-        'BookingsCheckedIn': 'sum',
-        'PersonsNights': 'sum',
-        'RoomNights': 'sum',
-        'DistributionChannel': mode,
-        'MarketSegment': mode,
-        'SRHighFloor': mode,
-        'SRLowFloor': mode,
-        'SRAccessibleRoom': mode,
-        'SRMediumFloor': mode,
-        'SRBathtub': mode,
-        'SRShower': mode,
-        'SRCrib': mode,
-        'SRKingSizeBed': mode,
-        'SRTwinBed': mode,
-        'SRNearElevator': mode,
-        'SRAwayFromElevator': mode,
-        'SRNoAlcoholInMiniBar': mode,
-        'SRQuietRoom': mode
-    }
-    
+# Aggregation rules applied per customer when merging their records
+aggregation_rules = {
+    'Age': 'median',
+    'DaysSinceCreation': 'max',
+    'AverageLeadTime': 'mean',
+    'LodgingRevenue': 'sum',
+    'OtherRevenue': 'sum',
+    'BookingsCanceled': 'sum',
+    'BookingsNoShowed': 'sum',
+    'BookingsCheckedIn': 'sum',
+    'PersonsNights': 'sum',
+    'RoomNights': 'sum',
+    'DistributionChannel': mode,
+    'MarketSegment': mode,
+    'SRHighFloor': mode,
+    'SRLowFloor': mode,
+    'SRAccessibleRoom': mode,
+    'SRMediumFloor': mode,
+    'SRBathtub': mode,
+    'SRShower': mode,
+    'SRCrib': mode,
+    'SRKingSizeBed': mode,
+    'SRTwinBed': mode,
+    'SRNearElevator': mode,
+    'SRAwayFromElevator': mode,
+    'SRNoAlcoholInMiniBar': mode,
+    'SRQuietRoom': mode
+}
+
+# Function to aggregate data based on 'DocIDHash','NameHash' and 'Nationality'
+def aggregation(dataframe, aggregation_rules=aggregation_rules):
     return dataframe.groupby(['DocIDHash','NameHash','Nationality']).agg(aggregation_rules).reset_index()
 
 # Clusters Exploration
@@ -0,0 +1,400 @@
+import hashlib
+import inspect
+import os
+import re
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sklearn.preprocessing import RobustScaler
+from sklearn.impute import KNNImputer
+
+import functions as f
+import utils as u
+
+
+# Numerical columns used for scaling and KNN imputation
+num_cols = ['Age', 'DaysSinceCreation', 'AverageLeadTime',
+            'LodgingRevenue', 'OtherRevenue', 'BookingsCanceled',
+            'BookingsNoShowed', 'BookingsCheckedIn',
+            'PersonsNights', 'RoomNights', 'TotalRevenue', 'RetentionRate',
+            'RevenuePerNight', 'RevenuePerPersonNight']
+
+
+## Stages
+# Load the raw data
+def load_data(path, sep=';', index_col='ID'):
+    return pd.read_csv(path, sep=sep, index_col=index_col)
+
+# Remove duplicates, inconsistent ages and records without a document hash
+def clean_data(df, min_age=16, max_age=90):
+    df = df.drop_duplicates()
+    df.loc[(df['Age'] < min_age) | (df['Age'] > max_age), 'Age'] = np.nan
+    return df.dropna(subset=['DocIDHash'])
+
+# Merge the records of the same customer
+def aggregate_data(df, aggregation_rules=f.aggregation_rules):
+    return f.aggregation(df, aggregation_rules)
+
+# Fix negative lead times and drop customers who did not generate revenue
+def filter_revenue(df):
+    df = df.copy()
+    df.loc[df['AverageLeadTime'] == -1, 'AverageLeadTime'] = np.nan
+    return df[(df['LodgingRevenue'] != 0) | (df['OtherRevenue'] != 0)]
+
+# Derive new features
+def derive_features(df, continent_dict=u.continent_dict, home_country='PRT'):
+    df = df.copy()
+    sr_cols = [col for col in df.columns if col.startswith('SR')]
+
+    df['TotalRevenue'] = df['LodgingRevenue'] + df['OtherRevenue']
+    df['RetentionRate'] = df['BookingsCheckedIn'] / (
+        df['BookingsCanceled'] + df['BookingsNoShowed'] + df['BookingsCheckedIn'] + 1
+    )
+    df['RevenuePerNight'] = df['TotalRevenue'] / (df['RoomNights'] + 1)
+    df['RevenuePerPersonNight'] = df['TotalRevenue'] / (df['PersonsNights'] + 1)
+    df['NumberOfSR'] = df[sr_cols].sum(axis=1)
+    df['Foreigner'] = (df['Nationality'] != home_country).astype(int)
+    df['Continent'] = df['Nationality'].map(continent_dict)
+
+    df['LeadTimeCategory'] = pd.cut(df['AverageLeadTime'], bins=[0, 3, 30, np.inf],
+                                    labels=['Last-minute', 'Planner', 'Early Booker'])
+    df['AgeGroup'] = pd.cut(df['Age'], bins=[0, 30, 50, np.inf],
+                            labels=['Young', 'Adult', 'Senior'])
+    df['CustomerCategory'] = pd.cut(df['DaysSinceCreation'], bins=[0, 365, 1095, np.inf],
+                                    labels=['New', 'Recent', 'Loyal'])
+    return df
+
+# One-hot encode the categorical features and keep the binary ones
+# Categories are sorted alphabetically before dropping the first, as OneHotEncoder(drop="first") does
+def encode_features(df, categorical_prefixes, keep_cols):
+    dummies = [pd.get_dummies(df[col].astype(object), prefix=prefix, drop_first=True, dtype=int)
+               for col, prefix in categorical_prefixes.items()]
+    return pd.concat([df[keep_cols]] + dummies, axis=1)
+
+# Scale, impute the missing values with KNN and restore the original scale
+def impute_features(df, num_cols=num_cols, n_neighbors=20):
+    scaler = RobustScaler()
+    imputer = KNNImputer(n_neighbors=n_neighbors, weights='uniform')
+
+    scaled = scaler.fit_transform(df[num_cols])
+    imputed = scaler.inverse_transform(imputer.fit_transform(scaled))
+
+    imputed_df = pd.DataFrame(imputed, columns=num_cols, index=df.index)
+    imputed_df['Age'] = imputed_df['Age'].round()
+    return imputed_df
+
+# Join the imputed numerical features with the encoded ones, following the given column order
+def combine_features(imputed_df, encoded_df, leading_cols):
+    df = pd.concat([imputed_df, encoded_df], axis=1)
+    return df[leading_cols + [col for col in df.columns if col not in leading_cols]]
+
+# Flag univariate and multivariate outliers
+def flag_outliers(df, outliers_dict=u.outliers_dict, multivariate_outliers=u.multivariate_outliers):
+    df = df.copy()
+    df['FlagOutlier'] = df.index.isin(multivariate_outliers).astype(int)
+
+    for col, params in outliers_dict.items():
+        if params['left_out'] is not None:
+            df['FlagOutlier'] |= (df[col] < params['left_out']).astype(int)
+        if params['right_out'] is not None:
+            df['FlagOutlier'] |= (df[col] > params['right_out']).astype(int)
+    return df
+
+# Keep the rows with the given outlier flag
+def select_outliers(df, flag=1):
+    return df[df['FlagOutlier'] == flag]
+
+
+# Declarative definition of the pre-processing pipeline
+# Each stage lists the stages it depends on (passed positionally) and its parameters
+stages = {
+    'load': {'func': load_data, 'deps': [],
+             'params': {'path': './Case1_HotelCustomerSegmentation.csv'}},
+    'clean': {'func': clean_data, 'deps': ['load'], 'params': {'min_age': 16, 'max_age': 90}},
+    'aggregate': {'func': aggregate_data, 'deps': ['clean'],
+                  'params': {'aggregation_rules': f.aggregation_rules}},
+    'filter': {'func': filter_revenue, 'deps': ['aggregate'], 'params': {}},
+    'features': {'func': derive_features, 'deps': ['filter'],
+                 'params': {'continent_dict': u.continent_dict, 'home_country': 'PRT'}},
+    'encode': {'func': encode_features, 'deps': ['features'],
+               'params': {'categorical_prefixes': {'LeadTimeCategory': 'LeadTimeCategory',
+                                                   'AgeGroup': 'AgeGroup',
+                                                   'CustomerCategory': 'CustomerCategory',
+                                                   'Continent': 'Continent',
+                                                   'DistributionChannel': 'DC'},
+                          'keep_cols': ['SRHighFloor', 'SRCrib', 'SRKingSizeBed', 'SRTwinBed',
+                                        'SRQuietRoom', 'NumberOfSR', 'Foreigner']}},
+    'impute': {'func': impute_features, 'deps': ['features'],
+               'params': {'num_cols': num_cols, 'n_neighbors': 20}},
+    'combine': {'func': combine_features, 'deps': ['impute', 'encode'],
+                'params': {'leading_cols': num_cols[:10] + ['SRHighFloor', 'SRCrib', 'SRKingSizeBed',
+                                                            'SRTwinBed', 'SRQuietRoom']
+                                           + num_cols[10:] + ['NumberOfSR', 'Foreigner']}},
+    'outliers': {'func': flag_outliers, 'deps': ['combine'],
+                 'params': {'outliers_dict': u.outliers_dict,
+                            'multivariate_outliers': u.multivariate_outliers}},
+    'outlier_rows': {'func': select_outliers, 'deps': ['outliers'], 'params': {'flag': 1}},
+    'treated_rows': {'func': select_outliers, 'deps': ['outliers'], 'params': {'flag': 0}},
+}
+
+# Files written from the final stages
+outputs = {'outlier_rows': './outliers.csv',
+           'treated_rows': './treated_data.csv'}
+
+
+## Caching
+# Folder of the project, used to tell its own helpers apart from installed libraries
+project_dir = os.path.dirname(os.path.abspath(__file__))
+
+def is_local(obj):
+    path = getattr(inspect.getmodule(obj), '__file__', None)
+    return path is not None and os.path.abspath(path).startswith(project_dir + os.sep)
+
+# Function to name the module of an object the same way whether it is imported or run as a script
+def module_name(obj):
+    name = getattr(obj, '__module__', None) or ''
+    path = getattr(inspect.getmodule(obj), '__file__', None)
+    if name == '__main__' and path is not None:
+        return os.path.splitext(os.path.basename(path))[0]
+    return name
+
+# Function to turn parameters into a stable string representation
+def fingerprint(obj, seen=None):
+    if isinstance(obj, dict):
+        items = sorted((fingerprint(k, seen), fingerprint(v, seen)) for k, v in obj.items())
+        return '{' + ','.join(f'{k}:{v}' for k, v in items) + '}'
+    if isinstance(obj, (list, tuple, set)):
+        items = [fingerprint(v, seen) for v in obj]
+        return '[' + ','.join(sorted(items) if isinstance(obj, set) else items) + ']'
+    if isinstance(obj, np.ndarray):
+        return fingerprint(obj.tolist(), seen)
+    if isinstance(obj, np.generic):
+        return repr(obj.item())
+    if callable(obj):
+        return source_of(obj, seen)
+    return repr(obj)
+
+# Function to list the global names used by a function, including in nested comprehensions
+def referenced_names(func):
+    codes, names = [func.__code__], set()
+    while codes:
+        code = codes.pop()
+        names.update(code.co_names)
+        codes.extend(const for const in code.co_consts if inspect.iscode(const))
+    return sorted(names)
+
+def source_of(func, seen=None):
+    """
+    Gets the source code of a function together with its defaults and the project helpers,
+    constants and module attributes it uses, so editing any of them invalidates the cache.
+
+    Parameters:
+        func (callable): Function to describe.
+        seen (set, optional): Ids of the functions already described, to avoid cycles.
+
+    Returns:
+        str: Text identifying the behaviour of the function.
+    """
+    seen = set() if seen is None else seen
+    name = f'{module_name(func)}.{getattr(func, "__qualname__", type(func).__name__)}'
+    if id(func) in seen:
+        return name
+    seen.add(id(func))
+
+    try:
+        parts = [name, inspect.getsource(func)]
+    except (OSError, TypeError):
+        return name
+    if not inspect.isfunction(func) or not is_local(func):
+        return '\n'.join(parts)
+
+    parts.append(fingerprint([func.__defaults__, func.__kwdefaults__], seen))
+    names = referenced_names(func)
+    for global_name in names:
+        if global_name not in func.__globals__:
+            continue
+        obj = func.__globals__[global_name]
+        if inspect.ismodule(obj):
+            # Only the attributes of local modules that are actually used, e.g. f.aggregation
+            if is_local(obj):
+                parts.extend(f'{global_name}.{attr}={fingerprint(getattr(obj, attr), seen)}'
+                             for attr in names
+                             if hasattr(obj, attr) and not inspect.ismodule(getattr(obj, attr)))
+        elif inspect.isfunction(obj):
+            if is_local(obj):
+                parts.append(f'{global_name}={source_of(obj, seen)}')
+        elif not callable(obj):
+            # Constants such as num_cols
+            parts.append(f'{global_name}={fingerprint(obj, seen)}')
+    return '\n'.join(parts)
+
+def stage_key(name, stage, dep_keys):
+    """
+    Computes the content hash of a stage from its code, parameters and upstream hashes.
+
+    Parameters:
+        name (str): Name of the stage.
+        stage (dict): Stage definition with 'func', 'deps' and 'params'.
+        dep_keys (dict): Hashes of the stages it depends on.
+
+    Returns:
+        str: Hexadecimal hash identifying the stage output.
+    """
+    h = hashlib.sha256()
+    h.update(name.encode())
+    h.update(source_of(stage['func']).encode())
+    h.update(fingerprint(stage['params']).encode())
+    for dep in stage['deps']:
+        h.update(dep_keys[dep].encode())
+
+    # Stages reading files also depend on their content
+    path = stage['params'].get('path')
+    if path is not None and os.path.exists(path):
+        with open(path, 'rb') as file:
+            for block in iter(lambda: file.read(1 << 20), b''):
+                h.update(block)
+    return h.hexdigest()[:16]
+
+# Function to sort stages so that each one comes after its dependencies
+def topological_order(stages):
+    order, visiting, done = [], set(), set()
+
+    def visit(name):
+        if name in done:
+            return
+        if name in visiting:
+            raise ValueError(f"Cycle detected at stage '{name}'.")
+        if name not in stages:
+            raise KeyError(f"Unknown stage '{name}'.")
+        visiting.add(name)
+        for dep in stages[name]['deps']:
+            visit(dep)
+        visiting.remove(name)
+        done.add(name)
+        order.append(name)
+
+    for name in stages:
+        visit(name)
+    return order
+
+def cache_path(cache_dir, name, key):
+    return os.path.join(cache_dir, f'{name}-{key}.parquet')
+
+# Function to check that a cache file exists and is a complete parquet file
+def is_readable(path):
+    try:
+        pq.read_metadata(path)
+        return True
+    except (OSError, ValueError, pa.ArrowException):
+        return False
+
+# Function to write a cache file atomically, so an interrupted run never leaves a truncated file
+def write_cache(result, path):
+    directory, filename = os.path.split(path)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f'{filename}.', suffix='.tmp')
+    os.close(fd)
+    try:
+        result.to_parquet(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+# Function to remove the older results of a stage, and temporary files left by interrupted runs
+def prune_cache(cache_dir, name, keep_path):
+    pattern = re.compile(rf'{re.escape(name)}-[0-9a-f]{{16}}\.parquet(\..+\.tmp)?')
+    for filename in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, filename)
+        if pattern.fullmatch(filename) and os.path.abspath(path) != os.path.abspath(keep_path):
+            os.remove(path)
+
+
+## Runner
+def run_pipeline(stages=stages, outputs=outputs, targets=None, cache_dir='./.pipeline_cache',
+                 max_workers=4, verbose=True):
+    """
+    Runs the pipeline, recomputing only the stages whose code, parameters or inputs changed.
+    Stage outputs are cached as parquet files and independent stages run in parallel.
+
+    Parameters:
+        stages (dict): Stage definitions with 'func', 'deps' and 'params'.
+        outputs (dict): CSV paths to write, keyed by stage name.
+        targets (list, optional): Stages to produce. Defaults to the stages in outputs,
+            or to every stage if no outputs are given.
+        cache_dir (str): Folder where the intermediate results are stored. Only the latest
+            result of each stage is kept.
+        max_workers (int): Number of stages that can run at the same time.
+        verbose (bool): Whether to print the status of each stage.
+
+    Returns:
+        dict: DataFrames of the stages that had to be loaded or computed, keyed by stage name.
+        pd.DataFrame: Summary with the hash, status and duration of each stage.
+    """
+    outputs = outputs or {}
+    targets = list(targets or outputs or stages)
+    order = topological_order(stages)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    keys = {}
+    for name in order:
+        keys[name] = stage_key(name, stages[name], keys)
+    # Unreadable files, e.g. left by an older interrupted run, count as misses
+    cached = {name: is_readable(cache_path(cache_dir, name, keys[name])) for name in order}
+
+    # A stage is needed if it is a target or feeds a stage that has to be recomputed
+    needed = set(targets)
+    for name in reversed(order):
+        if name in needed and not cached[name]:
+            needed.update(stages[name]['deps'])
+
+    results, summary = {}, {}
+
+    def materialise(name):
+        start = time.perf_counter()
+        path = cache_path(cache_dir, name, keys[name])
+        if cached[name]:
+            result, status = pd.read_parquet(path), 'cached'
+        else:
+            args = [results[dep] for dep in stages[name]['deps']]
+            result, status = stages[name]['func'](*args, **stages[name]['params']), 'computed'
+            write_cache(result, path)
+            prune_cache(cache_dir, name, path)
+        return result, status, time.perf_counter() - start
+
+    def ready(name):
+        return cached[name] or all(dep in results for dep in stages[name]['deps'])
+
+    pending = [name for name in order if name in needed]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        running = {}
+        while pending or running:
+            for name in [name for name in pending if ready(name)]:
+                pending.remove(name)
+                running[executor.submit(materialise, name)] = name
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                result, status, seconds = future.result()
+                results[name] = result
+                summary[name] = {'Key': keys[name], 'Status': status, 'Seconds': round(seconds, 2)}
+                if verbose:
+                    print(f'[{status}] {name} ({seconds:.2f}s)')
+
+    # Always write the outputs, since a cached stage may differ from the file on disk
+    for name, path in outputs.items():
+        if name in results:
+            results[name].to_csv(path, index=False)
+
+    for name in order:
+        summary.setdefault(name, {'Key': keys[name], 'Status': 'skipped', 'Seconds': 0.0})
+    return results, pd.DataFrame.from_dict(summary, orient='index').loc[order]
+
+
+if __name__ == '__main__':
+    run_pipeline()